@@ -4,8 +4,10 @@ from __future__ import annotations
 from typing import Any, Dict, List, Optional
 
 from temporalio import activity
-import structlog, json
-from sqlalchemy import text
+import structlog
+
+from . import services
+from .db import insert_event, update_order_address
 
 log = structlog.get_logger("activities")
 
@@ -13,7 +15,6 @@ log = structlog.get_logger("activities")
 @activity.defn
 async def receive_order(payload: Dict[str, Any]) -> Dict[str, Any]:
     """Create/record an order row. Payload: {order_id, address?, items?}"""
-    from . import services  # lazy import
     info = activity.info()
     order_id = payload["order_id"]
     address = payload.get("address")
@@ -27,7 +28,6 @@ async def receive_order(payload: Dict[str, Any]) -> Dict[str, Any]:
 @activity.defn
 async def validate_order(order: Dict[str, Any]) -> bool:
     """Validate order contents (raises on invalid)."""
-    from . import services  # lazy import
     info = activity.info()
     log.info("validate_order.start", order_id=order.get("order_id"), attempt=info.attempt)
     ok = await services.order_validated(order)
@@ -38,7 +38,6 @@ async def validate_order(order: Dict[str, Any]) -> bool:
 @activity.defn
 async def charge_payment(payload: Dict[str, Any]) -> Dict[str, Any]:
     """Payload: { order: {...}, payment_id: str }"""
-    from . import services  # lazy import
     info = activity.info()
     order = payload["order"]
     payment_id = payload["payment_id"]
@@ -61,7 +60,6 @@ async def charge_payment(payload: Dict[str, Any]) -> Dict[str, Any]:
 
 @activity.defn
 async def prepare_package(order: Dict[str, Any]) -> str:
-    from . import services  # lazy import
     info = activity.info()
     log.info("prepare_package.start", order_id=order.get("order_id"), attempt=info.attempt)
     s = await services.package_prepared(order)
@@ -71,7 +69,6 @@ async def prepare_package(order: Dict[str, Any]) -> str:
 
 @activity.defn
 async def dispatch_carrier(order: Dict[str, Any]) -> str:
-    from . import services  # lazy import
     info = activity.info()
     log.info("dispatch_carrier.start", order_id=order.get("order_id"), attempt=info.attempt)
     s = await services.carrier_dispatched(order)
@@ -82,7 +79,6 @@ async def dispatch_carrier(order: Dict[str, Any]) -> str:
 @activity.defn
 async def mark_shipped(payload: Dict[str, Any]) -> str:
     """Payload: { order_id: str }"""
-    from . import services  # lazy import
     info = activity.info()
     order_id = payload["order_id"]
     log.info("mark_shipped.start", order_id=order_id, attempt=info.attempt)
@@ -91,22 +87,37 @@ async def mark_shipped(payload: Dict[str, Any]) -> str:
     return s
 
 
+@activity.defn
+async def process_order_step(payload: Dict[str, Any]) -> str:
+    """
+    One transaction for a linear state transition.
+    Payload: { order_id, state, event_type, event_payload?, shipment_status? }
+    """
+    info = activity.info()
+    order_id = payload["order_id"]
+    log.info("process_order_step.start", order_id=order_id, state=payload["state"], attempt=info.attempt)
+    s = await services.order_step(
+        order_id=order_id,
+        state=payload["state"],
+        event_type=payload["event_type"],
+        event_payload=payload.get("event_payload"),
+        shipment_status=payload.get("shipment_status"),
+    )
+    log.info("process_order_step.done", order_id=order_id, state=s)
+    return s
+
+
 @activity.defn
 async def persist_address(payload: Dict[str, Any]) -> str:
     """
     Update only the address_json for an order (do NOT touch state).
     Payload: { order_id: str, address: {...} }
     """
-    from .db import Session, insert_event  # lazy import
     info = activity.info()
     order_id = payload["order_id"]
     address = payload["address"]
     log.info("persist_address.start", order_id=order_id, attempt=info.attempt)
-    async with Session.begin() as session:
-        await session.execute(
-            text("UPDATE orders SET address_json = :addr WHERE id = :oid"),
-            {"addr": json.dumps(address), "oid": order_id},
-        )
+    await update_order_address(order_id, address)
     await insert_event(order_id, "address_updated", address)
     log.info("persist_address.done", order_id=order_id)
     return "address_updated"
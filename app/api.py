@@ -1,13 +1,14 @@
 # app/api.py
 import os
-import asyncio
-from datetime import timedelta
+import functools
 from typing import Any, Dict, List, Optional
 
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from temporalio.client import Client
+from temporalio.client import Client, WorkflowHandle
 
+from .logging_setup import configure as configure_logging
+from .temporal_client import connect_temporal
 from .workflows import OrderWorkflow
 
 TEMPORAL_TARGET = os.getenv("TEMPORAL_TARGET", "localhost:7233")
@@ -30,22 +31,21 @@ class AddressBody(BaseModel):
 # --------- Startup / Shutdown ---------
 @app.on_event("startup")
 async def _startup():
-    # Retry until Temporal is ready
-    last_err: Optional[Exception] = None
-    for _ in range(60):  # ~30s
-        try:
-            app.state.temporal = await Client.connect(TEMPORAL_TARGET)
-            break
-        except Exception as e:
-            last_err = e
-            await asyncio.sleep(0.5)
-    else:
-        raise RuntimeError(f"Could not connect to Temporal at {TEMPORAL_TARGET}: {last_err}")
+    configure_logging()
+    # Retry until Temporal is ready; one long-lived client shared by all routes
+    app.state.temporal = await connect_temporal(TEMPORAL_TARGET)
 
 @app.on_event("shutdown")
 async def _shutdown():
-    # Nothing to close for temporal client
-    pass
+    # Nothing to close for temporal client; just drop cached handles
+    _order_handle.cache_clear()
+
+# --------- Helpers ---------
+@functools.lru_cache(maxsize=4096)
+def _order_handle(order_id: str) -> WorkflowHandle:
+    """Handle for the latest run of order-{order_id}; cached so repeat signals skip construction."""
+    client: Client = app.state.temporal
+    return client.get_workflow_handle(f"order-{order_id}")
 
 # --------- Routes ---------
 @app.get("/health")
@@ -68,35 +68,32 @@ async def start_order(order_id: str, payload: StartOrder):
         },
         id=f"order-{order_id}",
         task_queue=ORDERS_TQ,
-        run_timeout=timedelta(seconds=15),
+        # No run_timeout: a slow-but-progressing run shouldn't be killed and restarted;
+        # timeouts are budgeted per activity in workflows.py
     )
     return {"workflow_id": handle.id, "run_id": handle.result_run_id}
 
 @app.post("/orders/{order_id}/signals/approve")
 async def signal_approve(order_id: str):
-    client: Client = app.state.temporal
-    handle = client.get_workflow_handle(f"order-{order_id}")
+    handle = _order_handle(order_id)
     await handle.signal(OrderWorkflow.approve)
     return {"ok": True}
 
 @app.post("/orders/{order_id}/signals/cancel")
 async def signal_cancel(order_id: str, body: CancelBody):
-    client: Client = app.state.temporal
-    handle = client.get_workflow_handle(f"order-{order_id}")
+    handle = _order_handle(order_id)
     await handle.signal(OrderWorkflow.cancel_order, body.reason)
     return {"ok": True}
 
 @app.post("/orders/{order_id}/signals/address")
 async def signal_address(order_id: str, body: AddressBody):
-    client: Client = app.state.temporal
-    handle = client.get_workflow_handle(f"order-{order_id}")
+    handle = _order_handle(order_id)
     await handle.signal(OrderWorkflow.update_address, body.address)
     return {"ok": True}
 
 @app.get("/orders/{order_id}/status")
 async def status(order_id: str):
-    client: Client = app.state.temporal
-    handle = client.get_workflow_handle(f"order-{order_id}")
+    handle = _order_handle(order_id)
     try:
         st = await handle.query(OrderWorkflow.status)
     except Exception as e:
@@ -10,8 +10,18 @@ MYSQL_DB = os.getenv("MYSQL_DB", "trellis")
 MYSQL_USER = os.getenv("MYSQL_USER", "trellis")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "trellisPW")
 
+# asyncmy (Cython protocol parser) by default; SQLA_DRIVER=aiomysql to A/B
+SQLA_DRIVER = os.getenv("SQLA_DRIVER", "asyncmy")
+
 ASYNC_MYSQL_URI = (
-    f"mysql+aiomysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
+    f"mysql+{SQLA_DRIVER}://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
     "?charset=utf8mb4"
 )
 
+ORDERS_TQ = os.getenv("ORDERS_TQ", "orders-tq")
+SHIPPING_TQ = os.getenv("SHIPPING_TQ", "shipping-tq")
+
+# Run prepare_package/dispatch_carrier as activities of OrderWorkflow instead of a
+# ShippingWorkflow child (for deployments where one worker serves both queues).
+# Must be the same on every orders worker: it changes the workflow's command sequence.
+INLINE_SHIPPING = os.getenv("INLINE_SHIPPING") == "1"
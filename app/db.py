@@ -1,53 +1,272 @@
 # app/db.py
+"""
+Async SQLAlchemy engine + SQL helpers.
+
+Index requirements (db/init.sql; `python -m app.migrations` adds them to older DBs):
+* payments.payment_id PRIMARY KEY: the unique key behind the payment upsert's
+  ON DUPLICATE KEY UPDATE and a point seek for the SELECT ... FOR UPDATE.
+* payments ix_payments_order_status (order_id, status): per-order payment lookups.
+* shipments uq_ship_order_status (order_id, status): makes shipment step inserts idempotent
+  (and serves order_id-only lookups by prefix, so there is no separate order_id index).
+* events idx_evt_order_ts (order_id, ts): per-order audit trail reads.
+"""
 from __future__ import annotations
 
-import json
+import asyncio
 from typing import Any, Dict, Optional
 from datetime import datetime
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy import text
-from sqlalchemy.pool import NullPool   # <-- add this
+import orjson
 import os
 
-# pull your DSN the same way you already do (aiomysql driver on Windows)
+# pull your DSN the same way you already do
 MYSQL_HOST = os.getenv("MYSQL_HOST", "localhost")
 MYSQL_PORT = int(os.getenv("MYSQL_PORT", "3307"))
 MYSQL_DB   = os.getenv("MYSQL_DB", "trellis")
 MYSQL_USER = os.getenv("MYSQL_USER", "trellis")
 MYSQL_PWD  = os.getenv("MYSQL_PASSWORD", "trellisPW")
 
-# If you stayed on asyncmy, change aiomysql -> asyncmy here:
-ASYNC_MYSQL_URI = f"mysql+aiomysql://{MYSQL_USER}:{MYSQL_PWD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}?charset=utf8mb4"
+# asyncmy (Cython wire parser) by default; SQLA_DRIVER=aiomysql switches back
+SQLA_DRIVER = os.getenv("SQLA_DRIVER", "asyncmy")
+ASYNC_MYSQL_URI = f"mysql+{SQLA_DRIVER}://{MYSQL_USER}:{MYSQL_PWD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}?charset=utf8mb4"
 
-# 🔧 IMPORTANT: disable pooling to avoid cross-event-loop reuse in Temporal workers
-engine = create_async_engine(
-    ASYNC_MYSQL_URI,
-    pool_pre_ping=True,
-    poolclass=NullPool,   # <-- this is the key change
-    future=True,
-)
+def _dumps(x: Any) -> Optional[str]:
+    """
+    JSON-encode a payload for a JSON column (orjson: C/Rust fast path).
+    Empty payloads ({} / []) store NULL, as before: the order upsert's
+    COALESCE then keeps a stored address instead of overwriting it with '{}'.
+    """
+    return orjson.dumps(x).decode() if x else None
 
-Session: async_sessionmaker[AsyncSession] = async_sessionmaker(
-    engine, expire_on_commit=False
-)
 
-# --- your existing helpers (unchanged) ---
-async def insert_event(order_id: str, type_: str, payload: Optional[Dict[str, Any]] = None) -> None:
-    async with Session.begin() as session:
-        await session.execute(
-            text("INSERT INTO events (order_id, type, payload_json) VALUES (:oid, :t, :payload)"),
-            {"oid": order_id, "t": type_, "payload": json.dumps(payload) if payload else None},
+# --- SQL built once at import (no per-call text() construction) ---
+_SQL_INSERT_EVENT = text("INSERT INTO events (order_id, type, payload_json) VALUES (:oid, :t, :payload)")
+_SQL_UPDATE_ADDRESS = text("UPDATE orders SET address_json = :addr WHERE id = :oid")
+_SQL_UPSERT_ORDER = text("""
+    INSERT INTO orders (id, state, address_json)
+    VALUES (:oid, :st, :addr)
+    ON DUPLICATE KEY UPDATE state = VALUES(state),
+                            address_json = COALESCE(VALUES(address_json), address_json)
+""")
+
+# 🔧 IMPORTANT: pooled connections are bound to the event loop that opened them,
+# so keep one engine (and pool) per loop instead of sharing a global one.
+_engines: Dict[asyncio.AbstractEventLoop, AsyncEngine] = {}
+_sessionmakers: Dict[asyncio.AbstractEventLoop, async_sessionmaker[AsyncSession]] = {}
+_batchers: Dict[asyncio.AbstractEventLoop, "EventBatcher"] = {}
+
+
+def engine_for_current_loop() -> AsyncEngine:
+    """Return the pooled engine for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    engine = _engines.get(loop)
+    if engine is None:
+        # Forget engines whose loop is gone; their connections can't be reused anyway
+        for stale in [l for l in _engines if l.is_closed()]:
+            _engines.pop(stale, None)
+            _sessionmakers.pop(stale, None)
+            _batchers.pop(stale, None)
+        engine = create_async_engine(
+            ASYNC_MYSQL_URI,
+            pool_size=20,
+            max_overflow=10,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            query_cache_size=1200,
+            future=True,
         )
+        _engines[loop] = engine
+    return engine
+
+
+def Session() -> async_sessionmaker[AsyncSession]:
+    """Sessionmaker bound to the current loop's engine. Usage: `async with Session().begin() as s:`"""
+    loop = asyncio.get_running_loop()
+    maker = _sessionmakers.get(loop)
+    if maker is None:
+        maker = async_sessionmaker(engine_for_current_loop(), expire_on_commit=False)
+        _sessionmakers[loop] = maker
+    return maker
+
+
+async def dispose_engine() -> None:
+    """Flush pending events, then close the current loop's pool (call on worker shutdown)."""
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(loop)
+    if batcher is not None:
+        await batcher.drain()  # stays registered as closed -> later events write directly
+    _sessionmakers.pop(loop, None)
+    engine = _engines.pop(loop, None)
+    if engine is not None:
+        await engine.dispose()
+
+
+# --- statement helpers: run inside a caller-owned transaction ---
+async def write_event(session: AsyncSession, order_id: str, type_: str, payload: Optional[Dict[str, Any]] = None) -> None:
+    await session.execute(
+        _SQL_INSERT_EVENT,
+        {"oid": order_id, "t": type_, "payload": _dumps(payload)},
+    )
+
+async def write_order_state(session: AsyncSession, order_id: str, state: str, address: Optional[Dict[str, Any]] = None) -> None:
+    await session.execute(
+        _SQL_UPSERT_ORDER,
+        {"oid": order_id, "st": state, "addr": _dumps(address)},
+    )
+
+
+# --- event batching (free-standing events only; state-coupled events use write_event) ---
+class EventBatcher:
+    """
+    Coalesces insert_event() calls into one multi-row INSERT per flush.
+    No timer: a flush starts as soon as an event is queued, with whatever else is
+    already waiting (up to MAX_BATCH). A lone event on a serial path is written at
+    once; events that arrive while a flush is in flight go out together in the next.
+    enqueue() returns once the batch holding the event is committed, so errors
+    still reach the caller; a failed batch is retried row by row, so each caller
+    gets its own row's outcome.
+    """
+
+    MAX_BATCH = 128
+
+    def __init__(self) -> None:
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+
+    async def enqueue(self, order_id: str, type_: str, payload: Optional[Dict[str, Any]] = None) -> None:
+        if self._task is None or self._task.done():
+            # First use, or the dispatcher died (e.g. cancelled): start a fresh one
+            self._task = asyncio.create_task(self._dispatch())
+        fut = asyncio.get_running_loop().create_future()
+        params = {"oid": order_id, "t": type_, "payload": _dumps(payload)}
+        self._queue.put_nowait((params, fut))
+        await fut
+
+    async def drain(self) -> None:
+        """Flush whatever is queued and stop the background task."""
+        self.closed = True
+        if self._task is not None and not self._task.done():
+            self._queue.put_nowait(None)  # sentinel
+            await self._task
+
+    async def _dispatch(self) -> None:
+        batch: list = []
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is None:
+                    return
+                batch = [item]
+                stop = False
+                while len(batch) < self.MAX_BATCH and not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                await self._flush(batch)
+                batch = []
+                if stop:
+                    return
+        except BaseException:
+            # Don't leave callers waiting on a dispatcher that's gone: fail the
+            # in-flight batch and everything still queued (enqueue() restarts it)
+            err = RuntimeError("event batcher stopped")
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not None:
+                    batch.append(item)
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(err)
+            raise
+
+    async def _flush(self, batch: list) -> None:
+        try:
+            await self._write([params for params, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                _settle(batch[0][1], e)
+                return
+            # The batch shares one transaction across unrelated callers: retry row by
+            # row so one bad event fails (and retries) only its own activity
+            for params, fut in batch:
+                try:
+                    await self._write([params])
+                except Exception as row_err:
+                    _settle(fut, row_err)
+                else:
+                    _settle(fut)
+        else:
+            for _, fut in batch:
+                _settle(fut)
+
+    async def _write(self, rows: list) -> None:
+        async with Session().begin() as session:
+            # list of param dicts -> executemany -> single multi-row INSERT
+            await session.execute(_SQL_INSERT_EVENT, rows)
+
+
+def _settle(fut: asyncio.Future, err: Optional[BaseException] = None) -> None:
+    if fut.done():
+        return
+    if err is None:
+        fut.set_result(None)
+    else:
+        fut.set_exception(err)
+
+
+def _batcher_for_current_loop() -> EventBatcher:
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(loop)
+    if batcher is None:
+        batcher = _batchers[loop] = EventBatcher()
+    return batcher
+
+
+# --- your existing helpers ---
+async def insert_event(order_id: str, type_: str, payload: Optional[Dict[str, Any]] = None) -> None:
+    batcher = _batcher_for_current_loop()
+    if batcher.closed:
+        # Shutting down: write directly instead of queueing behind a stopped batcher
+        await _insert_event_direct(order_id, type_, payload)
+        return
+    await batcher.enqueue(order_id, type_, payload)
+
+async def _insert_event_direct(order_id: str, type_: str, payload: Optional[Dict[str, Any]] = None) -> None:
+    async with Session().begin() as session:
+        await write_event(session, order_id, type_, payload)
+
+def insert_event_sync(order_id: str, type_: str, payload: Optional[Dict[str, Any]] = None) -> None:
+    """Blocking, unbatched insert for callers with no event loop (scripts, plain threads)."""
+    async def _once() -> None:
+        try:
+            await _insert_event_direct(order_id, type_, payload)
+        finally:
+            await dispose_engine()  # the pool belongs to this throwaway loop
+    asyncio.run(_once())
 
 async def upsert_order_state(order_id: str, state: str, address: Optional[Dict[str, Any]] = None) -> None:
-    async with Session.begin() as session:
-        await session.execute(
-            text("""
-                INSERT INTO orders (id, state, address_json)
-                VALUES (:oid, :st, :addr)
-                ON DUPLICATE KEY UPDATE state = VALUES(state),
-                                        address_json = COALESCE(VALUES(address_json), address_json)
-            """),
-            {"oid": order_id, "st": state, "addr": json.dumps(address) if address else None},
-        )
+    async with Session().begin() as session:
+        await write_order_state(session, order_id, state, address)
+
+async def update_order_address(order_id: str, address: Dict[str, Any]) -> None:
+    """Update only address_json (state untouched)."""
+    async with Session().begin() as session:
+        # Always encoded (no empty -> NULL): this is an explicit address write
+        await session.execute(_SQL_UPDATE_ADDRESS, {"addr": orjson.dumps(address).decode(), "oid": order_id})
+
+async def upsert_and_event(
+    order_id: str,
+    state: str,
+    event_type: str,
+    payload: Optional[Dict[str, Any]] = None,
+    address: Optional[Dict[str, Any]] = None,
+) -> None:
+    """State upsert + event insert in ONE transaction (one commit instead of two)."""
+    async with Session().begin() as session:
+        await write_order_state(session, order_id, state, address)
+        await write_event(session, order_id, event_type, payload)
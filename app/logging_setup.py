@@ -1,7 +1,21 @@
 # app/logging_setup.py
-import logging, structlog
+import atexit, logging, queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+import orjson, structlog
+
+_listener: Optional[QueueListener] = None
+
+
+def _orjson_dumps(obj, **kw) -> str:
+    # stdlib logging wants str; orjson returns bytes. OPT_NON_STR_KEYS: like stdlib
+    # json, accept int/etc. dict keys (e.g. counts={1: 2}) instead of raising in the caller
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS, **kw).decode()
+
 
 def configure(level=logging.INFO):
+    global _listener
     timestamper = structlog.processors.TimeStamper(fmt="iso")
     structlog.configure(
         processors=[
@@ -10,9 +24,22 @@ def configure(level=logging.INFO):
             timestamper,
             structlog.processors.StackInfoRenderer(),
             structlog.processors.format_exc_info,
-            structlog.processors.JSONRenderer(),
+            structlog.processors.JSONRenderer(serializer=_orjson_dumps),
         ],
+        # Route through stdlib logging so the QueueHandler below picks records up
+        logger_factory=structlog.stdlib.LoggerFactory(),
         wrapper_class=structlog.make_filtering_bound_logger(level),
         cache_logger_on_first_use=True,
     )
-    logging.basicConfig(level=level)
+    logging.basicConfig(level=level, format="%(message)s")
+
+    # Only the stream write moves to the listener thread: JSON rendering runs in the
+    # caller's structlog processor chain, and QueueHandler.prepare() formats the record
+    # on the emitting thread too. Output is JSON on stderr (basicConfig's StreamHandler).
+    if _listener is None:
+        q: queue.Queue = queue.Queue(-1)
+        root = logging.getLogger()
+        _listener = QueueListener(q, *(root.handlers or [logging.StreamHandler()]), respect_handler_level=True)
+        root.handlers = [QueueHandler(q)]
+        _listener.start()
+        atexit.register(_listener.stop)
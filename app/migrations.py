@@ -0,0 +1,144 @@
+# app/migrations.py
+"""
+Idempotent index migrations for databases created from an older db/init.sql
+(docker-entrypoint only runs init.sql on a fresh volume).
+
+Run: python -m app.migrations
+     python -m app.migrations --dedupe [--dry-run]   # first, if shipments has duplicate step rows
+
+MySQL DDL commits implicitly, so none of this is transactional: it runs on an
+autocommit connection and every step is safe to re-run instead.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+from typing import List, Optional, Tuple
+
+import structlog
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+log = structlog.get_logger("migrations")
+
+_SQL_INDEX_EXISTS = text(
+    """
+    SELECT COUNT(*) FROM information_schema.statistics
+    WHERE table_schema = DATABASE() AND table_name = :t AND index_name = :i
+    """
+)
+# Retries used to insert duplicate shipment step rows; every row but the earliest per step
+_SQL_SHIP_DUPES = text(
+    """
+    SELECT DISTINCT s1.id, s1.order_id, s1.status FROM shipments s1
+    JOIN shipments s2
+      ON s1.order_id = s2.order_id AND s1.status = s2.status AND s1.id > s2.id
+    ORDER BY s1.id
+    """
+)
+_SQL_SHIP_DEDUPE = text(
+    """
+    DELETE s1 FROM shipments s1
+    JOIN shipments s2
+      ON s1.order_id = s2.order_id AND s1.status = s2.status AND s1.id > s2.id
+    """
+)
+
+# (table, index, DDL). MySQL 8 has no CREATE INDEX IF NOT EXISTS,
+# so each index is checked against information_schema first.
+INDEXES: List[Tuple[str, str, str]] = [
+    (
+        "payments",
+        "ix_payments_order_status",
+        "CREATE INDEX ix_payments_order_status ON payments (order_id, status)",
+    ),
+    (
+        "shipments",
+        "uq_ship_order_status",
+        "CREATE UNIQUE INDEX uq_ship_order_status ON shipments (order_id, status)",
+    ),
+]
+
+# (table, index, covering index, DDL): dropped once the covering index exists
+REDUNDANT_INDEXES: List[Tuple[str, str, str, str]] = [
+    # order_id-only lookups use the (order_id, status) unique key's prefix
+    ("shipments", "idx_ship_order", "uq_ship_order_status", "DROP INDEX idx_ship_order ON shipments"),
+]
+
+
+async def shipment_duplicates(conn: AsyncConnection) -> List[Tuple[int, str, str]]:
+    """(id, order_id, status) of the shipment rows --dedupe would delete."""
+    return [tuple(r) for r in (await conn.execute(_SQL_SHIP_DUPES)).all()]
+
+
+async def dedupe_shipments(conn: AsyncConnection, dry_run: bool = False) -> int:
+    """Log and (unless dry_run) delete duplicate shipment step rows; returns how many."""
+    dupes = await shipment_duplicates(conn)
+    for id_, order_id, status in dupes:
+        log.info("shipment_duplicate", id=id_, order_id=order_id, status=status, dry_run=dry_run)
+    if dupes and not dry_run:
+        await conn.execute(_SQL_SHIP_DEDUPE)
+    return len(dupes)
+
+
+async def apply_migrations(conn: AsyncConnection) -> List[str]:
+    """Create missing indexes and drop redundant ones; returns what changed. Never deletes data."""
+    applied: List[str] = []
+    for table, index, ddl in INDEXES:
+        if await conn.scalar(_SQL_INDEX_EXISTS, {"t": table, "i": index}):
+            continue
+        if index == "uq_ship_order_status" and await shipment_duplicates(conn):
+            raise RuntimeError(
+                "shipments has duplicate (order_id, status) rows; "
+                "review them with `python -m app.migrations --dedupe --dry-run`, then rerun without --dry-run"
+            )
+        try:
+            await conn.execute(text(ddl))
+        except Exception:
+            # Another process (e.g. a parallel test worker) may have won the race
+            if await conn.scalar(_SQL_INDEX_EXISTS, {"t": table, "i": index}):
+                continue
+            raise
+        applied.append(index)
+    for table, index, covering, ddl in REDUNDANT_INDEXES:
+        if not await conn.scalar(_SQL_INDEX_EXISTS, {"t": table, "i": covering}):
+            continue
+        if not await conn.scalar(_SQL_INDEX_EXISTS, {"t": table, "i": index}):
+            continue
+        try:
+            await conn.execute(text(ddl))
+        except Exception:
+            if not await conn.scalar(_SQL_INDEX_EXISTS, {"t": table, "i": index}):
+                continue  # dropped by a concurrent run
+            raise
+        applied.append(f"drop {index}")
+    return applied
+
+
+async def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.migrations")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="delete duplicate shipment step rows (keeps the earliest) before adding uq_ship_order_status")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="with --dedupe: only report the rows that would be deleted")
+    args = parser.parse_args(argv)
+
+    from .config import ASYNC_MYSQL_URI  # noqa: F401  (loads .env before db reads it)
+    from .db import dispose_engine, engine_for_current_loop
+
+    try:
+        async with engine_for_current_loop().connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            if args.dedupe:
+                n = await dedupe_shipments(conn, dry_run=args.dry_run)
+                log.info("shipments_deduped", rows=n, dry_run=args.dry_run)
+                if args.dry_run:
+                    return
+            applied = await apply_migrations(conn)
+    finally:
+        await dispose_engine()
+    log.info("migrations_applied", indexes=applied)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,28 @@
+# app/temporal_client.py
+from __future__ import annotations
+
+import asyncio
+import random
+from typing import Optional
+
+from temporalio.client import Client
+
+# 10 attempts -> 9 sleeps: 0.1+0.2+0.4+0.8+1.6+3.2+5+5+5 = 21.3s, up to ~32s with
+# the +50% jitter (plus however long each failed connect itself takes)
+CONNECT_ATTEMPTS = 10
+
+
+async def connect_temporal(target: str, attempts: int = CONNECT_ATTEMPTS) -> Client:
+    """Connect once (one long-lived gRPC channel), retrying with exponential backoff + jitter."""
+    last_err: Optional[Exception] = None
+    delay = 0.1
+    for attempt in range(attempts):
+        try:
+            # gRPC keepalive is already on by default (KeepAliveConfig.default: 30s/15s)
+            return await Client.connect(target)
+        except Exception as e:
+            last_err = e
+        if attempt + 1 < attempts:
+            await asyncio.sleep(delay * (1 + random.random() * 0.5))
+            delay = min(delay * 2, 5.0)
+    raise RuntimeError(f"Could not connect to Temporal at {target}: {last_err}")
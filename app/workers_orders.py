@@ -3,14 +3,18 @@ from __future__ import annotations
 
 import os
 import asyncio
+from datetime import timedelta
+
 import structlog
 
-from temporalio.client import Client
 from temporalio.worker import Worker
 
 
 # Loads .env on import (see your existing config.py)
-from .config import ASYNC_MYSQL_URI  # not used here, but keeps DB env loaded
+from .config import ASYNC_MYSQL_URI, INLINE_SHIPPING  # ASYNC_MYSQL_URI unused, but keeps DB env loaded
+from .db import dispose_engine
+from .logging_setup import configure as configure_logging
+from .temporal_client import connect_temporal
 
 # Activities for the orders side
 from .activities import (
@@ -19,6 +23,9 @@ from .activities import (
     charge_payment,
     persist_address,
     mark_shipped,
+    process_order_step,
+    prepare_package,
+    dispatch_carrier,
 )
 
 # Order workflow (we'll add this in app/workflows.py next)
@@ -32,29 +39,46 @@ log = structlog.get_logger("worker.orders")
 
 
 async def main() -> None:
+    configure_logging()
     # Connect to Temporal dev server
-    client = await Client.connect(TEMPORAL_TARGET)
+    client = await connect_temporal(TEMPORAL_TARGET)
     log.info("connected_to_temporal", target=TEMPORAL_TARGET)
 
     # Register workflows + activities on the orders task queue
+    activities = [
+        receive_order,
+        validate_order,
+        charge_payment,
+        persist_address,   # used by UpdateAddress signal handler
+        mark_shipped,
+        process_order_step,  # generic single-transaction step (mark shipped)
+    ]
+    if INLINE_SHIPPING:
+        # OrderWorkflow runs the shipping steps itself instead of a child on shipping-tq
+        activities += [prepare_package, dispatch_carrier]
+
     worker = Worker(
         client=client,
         task_queue=ORDERS_TQ,
         workflows=[OrderWorkflow],
-        activities=[
-            receive_order,
-            validate_order,
-            charge_payment,
-            persist_address,   # used by UpdateAddress signal handler
-            mark_shipped,
-        ],
+        activities=activities,
         # Tweak concurrency as you like; defaults are fine for the take-home
         max_concurrent_activities=50,
         max_concurrent_workflow_tasks=20,
+        # Keep workflows sticky to this worker (cached, no full-history replay per task)
+        max_cached_workflows=10_000,
+        sticky_queue_schedule_to_start_timeout=timedelta(seconds=5),
+        # More pollers than the default 5 so both task queues stay saturated
+        max_concurrent_workflow_task_polls=10,
+        max_concurrent_activity_task_polls=10,
     )
 
     log.info("orders_worker_started", task_queue=ORDERS_TQ)
-    await worker.run()
+    try:
+        await worker.run()
+    finally:
+        # Release pooled DB connections held by this worker's event loop
+        await dispose_engine()
 
 
 if __name__ == "__main__":
@@ -5,13 +5,15 @@ import os
 import asyncio
 import structlog
 
-from temporalio.client import Client
 from temporalio.worker import Worker
 
 
 
 # Load env via config import side effect (not directly used here)
 from .config import ASYNC_MYSQL_URI  # noqa: F401
+from .db import dispose_engine
+from .logging_setup import configure as configure_logging
+from .temporal_client import connect_temporal
 
 # Shipping activities
 from .activities import prepare_package, dispatch_carrier
@@ -26,7 +28,8 @@ log = structlog.get_logger("worker.shipping")
 
 
 async def main() -> None:
-    client = await Client.connect(TEMPORAL_TARGET)
+    configure_logging()
+    client = await connect_temporal(TEMPORAL_TARGET)
     log.info("connected_to_temporal", target=TEMPORAL_TARGET)
 
     worker = Worker(
@@ -42,7 +45,11 @@ async def main() -> None:
     )
 
     log.info("shipping_worker_started", task_queue=SHIPPING_TQ)
-    await worker.run()
+    try:
+        await worker.run()
+    finally:
+        # Release pooled DB connections held by this worker's event loop
+        await dispose_engine()
 
 
 if __name__ == "__main__":
@@ -1,22 +1,38 @@
 # app/workflows.py
 from __future__ import annotations
 
+import asyncio
 from dataclasses import dataclass
 from datetime import timedelta
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
 
 from temporalio import workflow
 from temporalio.common import RetryPolicy
 
+with workflow.unsafe.imports_passed_through():
+    # Small in-process DB writes run as local activities (no task-queue round-trip)
+    from .activities import persist_address, process_order_step
+    from .config import INLINE_SHIPPING, SHIPPING_TQ
+
 ACT_START_TO_CLOSE = timedelta(seconds=2)
 ACT_SCHEDULE_TO_CLOSE = timedelta(seconds=8)
+# Tighter total budget for the idempotent, retry-safe steps (receive_order, charge_payment);
+# timeouts are budgeted per activity since the workflow itself has no run_timeout.
+ACT_SCHEDULE_TO_CLOSE_IDEMPOTENT = timedelta(seconds=4)
 ACT_RETRY = RetryPolicy(
     initial_interval=timedelta(milliseconds=500),
     backoff_coefficient=1.5,
     maximum_attempts=2,
 )
 MANUAL_REVIEW_WINDOW = timedelta(seconds=3)
-SHIPPING_TASK_QUEUE = "shipping-tq"
+SHIPPING_TASK_QUEUE = SHIPPING_TQ  # env SHIPPING_TQ (default "shipping-tq")
+
+# workflow.patched() ids: histories recorded before a change replay the old path
+PATCH_RESULT_DICT = "order-result-dict"
+PATCH_LOCAL_PERSIST_ADDRESS = "local-persist-address"
+PATCH_LOCAL_MARK_SHIPPED = "local-mark-shipped"
+PATCH_REVIEW_WAIT_CONDITION = "review-wait-condition"
+PATCH_INLINE_SHIPPING = "inline-shipping"
 
 
 @workflow.defn
@@ -78,9 +94,18 @@ class _OrderState:
 
 @workflow.defn
 class OrderWorkflow:
-    def __init__(self) -> None:
-        # Initialize state so signals arriving before run() don't crash
-        self.s: _OrderState = _OrderState(order_id="", payment_id="")
+    @workflow.init
+    def __init__(self, payload: Dict[str, Any]) -> None:
+        # Build state from the input here, not in run(): with signal-with-start the
+        # start signal (e.g. approve, update_address) is handled before run() begins,
+        # and must not be wiped by a fresh _OrderState.
+        self.s: _OrderState = _OrderState(
+            order_id=payload["order_id"],
+            payment_id=payload["payment_id"],
+            address=payload.get("address"),
+            items=payload.get("items"),
+        )
+        self._package_prepared = False  # inline shipping: a retry only re-runs dispatch
 
     # --------- Signals ---------
     @workflow.signal
@@ -117,8 +142,12 @@ class OrderWorkflow:
 
     # ---------- Run ----------
     @workflow.run
-    async def run(self, payload: Dict[str, Any]) -> str:
+    async def run(self, payload: Dict[str, Any]) -> Union[str, Dict[str, Any]]:
         """
+        Returns: {"result": "shipped" | "failed" | "canceled", "approved", "step", "last_error"}
+        (final state inline, so callers don't need a follow-up status query).
+        Runs that completed before PATCH_RESULT_DICT returned the bare string.
+
         Expects: {
           "order_id": "...",
           "payment_id": "...",
@@ -126,28 +155,23 @@ class OrderWorkflow:
           "items": [ ... ] | None
         }
         """
-        order_id: str = payload["order_id"]
-        payment_id: str = payload["payment_id"]
-        address: Optional[Dict[str, Any]] = payload.get("address")
-        items: Optional[List[Dict[str, Any]]] = payload.get("items")
-
-        self.s = _OrderState(order_id=order_id, payment_id=payment_id, address=address, items=items)
+        # self.s was built from payload in __init__ (and may already carry signals)
 
         # --- ReceiveOrder ---
         self._set_step("receive_order")
         order = await workflow.execute_activity(
             "receive_order",
             {  # SINGLE payload dict
-                "order_id": order_id,
-                "address": address,
-                "items": items,
+                "order_id": self.s.order_id,
+                "address": self.s.address,  # latest, if update_address came before run()
+                "items": self.s.items,
             },
             start_to_close_timeout=ACT_START_TO_CLOSE,
-            schedule_to_close_timeout=ACT_SCHEDULE_TO_CLOSE,
+            schedule_to_close_timeout=ACT_SCHEDULE_TO_CLOSE_IDEMPOTENT,
             retry_policy=ACT_RETRY,
         )
         if self.s.canceled:
-            return "canceled"
+            return self._result("canceled")
 
         # --- ValidateOrder ---
         self._set_step("validate_order")
@@ -159,32 +183,53 @@ class OrderWorkflow:
             retry_policy=ACT_RETRY,
         )
         if self.s.canceled:
-            return "canceled"
+            return self._result("canceled")
 
         # --- Persist latest address if a signal updated it during validation ---
         if self.s.address is not None:
-            await workflow.execute_activity(
-                "persist_address",
-                {  # SINGLE payload dict
-                    "order_id": self.s.order_id,
-                    "address": self.s.address,
-                },
-                start_to_close_timeout=ACT_START_TO_CLOSE,
-                schedule_to_close_timeout=ACT_SCHEDULE_TO_CLOSE,
-                retry_policy=ACT_RETRY,
-            )
+            address_payload = {  # SINGLE payload dict
+                "order_id": self.s.order_id,
+                "address": self.s.address,
+            }
+            if workflow.patched(PATCH_LOCAL_PERSIST_ADDRESS):
+                await workflow.execute_local_activity(
+                    persist_address,
+                    address_payload,
+                    start_to_close_timeout=ACT_START_TO_CLOSE,
+                    retry_policy=ACT_RETRY,
+                )
+            else:
+                # Pre-patch histories scheduled a regular activity here
+                await workflow.execute_activity(
+                    "persist_address",
+                    address_payload,
+                    start_to_close_timeout=ACT_START_TO_CLOSE,
+                    schedule_to_close_timeout=ACT_SCHEDULE_TO_CLOSE,
+                    retry_policy=ACT_RETRY,
+                )
 
         # --- Manual Review Gate (timer + approve signal) ---
         self._set_step("awaiting_approval")
-        deadline = workflow.now() + MANUAL_REVIEW_WINDOW
-        while not self.s.approved and not self.s.canceled and workflow.now() < deadline:
-            await workflow.sleep(timedelta(milliseconds=100))
+        if workflow.patched(PATCH_REVIEW_WAIT_CONDITION):
+            # Single timer; the approve/cancel signal handlers wake this immediately
+            try:
+                await workflow.wait_condition(
+                    lambda: self.s.approved or self.s.canceled,
+                    timeout=MANUAL_REVIEW_WINDOW,
+                )
+            except asyncio.TimeoutError:
+                pass
+        else:
+            # Pre-patch histories polled with 100ms timers
+            deadline = workflow.now() + MANUAL_REVIEW_WINDOW
+            while not self.s.approved and not self.s.canceled and workflow.now() < deadline:
+                await workflow.sleep(timedelta(milliseconds=100))
 
         if self.s.canceled:
-            return "canceled"
+            return self._result("canceled")
         if not self.s.approved:
             self.s.last_error = "manual_review_timeout"
-            return "failed"
+            return self._result("failed")
 
         # --- ChargePayment (idempotent) ---
         self._set_step("charge_payment")
@@ -195,25 +240,29 @@ class OrderWorkflow:
                 "payment_id": self.s.payment_id,
             },
             start_to_close_timeout=ACT_START_TO_CLOSE,
-            schedule_to_close_timeout=ACT_SCHEDULE_TO_CLOSE,
+            schedule_to_close_timeout=ACT_SCHEDULE_TO_CLOSE_IDEMPOTENT,
             retry_policy=ACT_RETRY,
         )
 
-        # --- Start child ShippingWorkflow on separate TQ ---
+        # --- Start child ShippingWorkflow on separate TQ (or inline, see INLINE_SHIPPING) ---
+        # Step name stays "shipping_child" either way, so status output doesn't depend on the flag.
+        # The patch keeps pre-flag histories on the child path when the flag is turned on; turning
+        # it off again needs inline runs drained first (their histories have no child to replay).
+        inline = INLINE_SHIPPING and workflow.patched(PATCH_INLINE_SHIPPING)
         self._set_step("shipping_child")
         attempts = 0
         while True:
             attempts += 1
             self.s.child_attempts = attempts
             try:
+                if inline:
+                    await self._ship_inline({**order, "address": self.s.address})
+                    break
                 await workflow.execute_child_workflow(
                     ShippingWorkflow.run,
                     {
-                        "order": {
-                            "order_id": self.s.order_id,
-                            "items": order.get("items"),
-                            "address": self.s.address,
-                        },
+                        # Reuse the order materialized by receive_order (latest address wins)
+                        "order": {**order, "address": self.s.address},
                         "parent_workflow_id": self._workflow_id(),
                     },
                     id=f"ship-{self.s.order_id}-{attempts}",
@@ -224,23 +273,73 @@ class OrderWorkflow:
             except Exception as e:
                 self.s.last_error = f"shipping_failed: {e!s}"
                 if attempts >= 2:
-                    return "failed"
+                    return self._result("failed")
                 # else retry once
 
         # --- Mark order shipped in DB ---
         self._set_step("mark_shipped")
-        await workflow.execute_activity(
-            "mark_shipped",
-            {"order_id": self.s.order_id},  # SINGLE payload dict
-            start_to_close_timeout=ACT_START_TO_CLOSE,
-            schedule_to_close_timeout=ACT_SCHEDULE_TO_CLOSE,
-            retry_policy=ACT_RETRY,
-        )
+        if workflow.patched(PATCH_LOCAL_MARK_SHIPPED):
+            await workflow.execute_local_activity(
+                process_order_step,
+                {  # SINGLE payload dict
+                    "order_id": self.s.order_id,
+                    "state": "shipped",
+                    "event_type": "order_shipped",
+                },
+                start_to_close_timeout=ACT_START_TO_CLOSE,
+                retry_policy=ACT_RETRY,
+            )
+        else:
+            # Pre-patch histories scheduled the mark_shipped activity here
+            await workflow.execute_activity(
+                "mark_shipped",
+                {"order_id": self.s.order_id},  # SINGLE payload dict
+                start_to_close_timeout=ACT_START_TO_CLOSE,
+                schedule_to_close_timeout=ACT_SCHEDULE_TO_CLOSE,
+                retry_policy=ACT_RETRY,
+            )
 
         self._set_step("done")
-        return "shipped"
+        return self._result("shipped")
 
     # ---------- Helpers ----------
+    def _result(self, result: str) -> Union[str, Dict[str, Any]]:
+        if not workflow.patched(PATCH_RESULT_DICT):
+            return result  # replaying a pre-patch history: keep its recorded str result
+        return {
+            "result": result,
+            "approved": self.s.approved,
+            "step": self.s.current_step,
+            "last_error": self.s.last_error,
+        }
+
+    async def _ship_inline(self, order: Dict[str, Any]) -> None:
+        """
+        Same steps as ShippingWorkflow.run, as activities on this workflow (no child/external-signal RPCs).
+        Unlike a fresh child, a retry skips prepare_package once it has succeeded.
+        """
+        if not self._package_prepared:
+            await workflow.execute_activity(
+                "prepare_package",
+                order,
+                start_to_close_timeout=ACT_START_TO_CLOSE,
+                schedule_to_close_timeout=ACT_SCHEDULE_TO_CLOSE,
+                retry_policy=ACT_RETRY,
+            )
+            self._package_prepared = True
+        try:
+            await workflow.execute_activity(
+                "dispatch_carrier",
+                order,
+                start_to_close_timeout=ACT_START_TO_CLOSE,
+                schedule_to_close_timeout=ACT_SCHEDULE_TO_CLOSE,
+                retry_policy=ACT_RETRY,
+            )
+        except Exception as e:
+            # What the child would have signalled via dispatch_failed
+            self.s.dispatch_failed_reason = str(e)
+            raise
+
     def _set_step(self, step: str) -> None:
         self.s.current_step = step
 
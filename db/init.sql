@@ -14,6 +14,7 @@ CREATE TABLE IF NOT EXISTS payments (
   amount       DECIMAL(10,2) NOT NULL,
   created_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
   updated_at   TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  INDEX ix_payments_order_status (order_id, status),
   CONSTRAINT fk_pay_order FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE
 );
 
@@ -23,7 +24,7 @@ CREATE TABLE IF NOT EXISTS shipments (
   status       ENUM('prepared','dispatched','failed') NOT NULL,
   payload_json JSON NULL,
   ts           TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-  INDEX idx_ship_order (order_id)
+  UNIQUE KEY uq_ship_order_status (order_id, status)  -- one row per step, so retries are idempotent
 );
 
 CREATE TABLE IF NOT EXISTS events (
@@ -5,15 +5,61 @@ if sys.platform.startswith("win"):
     # aiomysql requires the Selector loop on Windows
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+import itertools
 import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from dotenv import load_dotenv
+import pytest
 import pytest_asyncio
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy import text
+from temporalio.client import Client
+from temporalio.testing import WorkflowEnvironment
+from temporalio.worker import UnsandboxedWorkflowRunner, Worker
 
 # Load .env so port/creds match your compose
 load_dotenv()
 
+# No random failures / long sleeps in any test (checked once when app.services is imported)
+os.environ["TRELLIS_DISABLE_FLAKY"] = "1"
+
+# Per-process task queue so parallel xdist workers never poll each other's queues.
+# Orders and shipping share it: the child ShippingWorkflow lands on the same single
+# test Worker (half the pollers of a worker per queue).
+os.environ["ORDERS_TQ"] = os.environ["SHIPPING_TQ"] = f"trellis-tq-{os.getpid()}"
+
+# app.* reads env at import, so import after load_dotenv()
+from app.config import ORDERS_TQ
+from app.db import dispose_engine
+from app.migrations import apply_migrations
+from app.workflows import OrderWorkflow, ShippingWorkflow
+from app.activities import (
+    receive_order,
+    validate_order,
+    charge_payment,
+    persist_address,
+    mark_shipped,
+    process_order_step,
+    prepare_package,
+    dispatch_carrier,
+)
+_INIT_SQL = Path(__file__).resolve().parent.parent / "db" / "init.sql"
+
+# One id source for every test module in this process: pid + one random token per session
+# (the MySQL DB outlives test runs, so a bare pid could repeat), then a shared counter.
+# Per-module tokens could collide on "o-<pid>-<tok>-0" across modules.
+_RUN = f"{os.getpid()}-{secrets.token_hex(4)}"
+_IDS = itertools.count()
+
+
+@pytest.fixture(scope="session")
+def new_order_id():
+    """Call for a fresh order id, unique across modules, processes and runs."""
+    return lambda: f"o-{_RUN}-{next(_IDS)}"
+
+
 @pytest_asyncio.fixture(scope="session")
 async def db_ready():
     host = os.getenv("MYSQL_HOST", "localhost")
@@ -22,8 +68,8 @@ async def db_ready():
     user = os.getenv("MYSQL_USER", "trellis")
     pwd  = os.getenv("MYSQL_PASSWORD", "trellisPW")
 
-    # Driver should match your app (aiomysql if you switched)
-    driver = os.getenv("SQLA_DRIVER", "aiomysql")  # set to "asyncmy" if you kept asyncmy
+    # Driver should match your app (app/db.py reads the same SQLA_DRIVER toggle)
+    driver = os.getenv("SQLA_DRIVER", "asyncmy")  # set to "aiomysql" to A/B the pure-Python driver
     uri = f"mysql+{driver}://{user}:{pwd}@{host}:{port}/{db}?charset=utf8mb4"
 
     engine = create_async_engine(uri, pool_pre_ping=True)
@@ -32,8 +78,102 @@ async def db_ready():
         async with engine.begin() as conn:
             await conn.scalar(text("SELECT 1"))
     except Exception as e:
-        import pytest
         pytest.skip(f"MySQL not reachable at {host}:{port} ({e})")
 
+    # Schema + indexes once per session (all idempotent). No per-test truncation:
+    # every test writes under its own random order_id/payment_id. DDL auto-commits in
+    # MySQL, so run it on an autocommit connection rather than pretend it's one transaction.
+    # apply_migrations never deletes data (duplicate shipment rows are `--dedupe`'s job).
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for stmt in _INIT_SQL.read_text().split(";"):
+            if stmt.strip():
+                await conn.execute(text(stmt))
+        await apply_migrations(conn)
+
     yield
     await engine.dispose()
+    # Flush any batched events and close the app's pool for this (session) loop
+    await dispose_engine()
+
+
+# Per-test transaction that is rolled back at teardown, for tests that call app.services
+# directly: nothing is committed, so no fsync and nothing left behind. Every Session()
+# on this loop joins the outer transaction; their own begin()/commit() become savepoints.
+# (Workflow tests keep real commits: their activities run concurrently, and one
+# connection can't be shared across them.)
+@pytest_asyncio.fixture
+async def db_rollback(db_ready, monkeypatch):
+    import app.db as db
+
+    loop = asyncio.get_running_loop()
+    async with db.engine_for_current_loop().connect() as conn:
+        outer = await conn.begin()
+        monkeypatch.setitem(
+            db._sessionmakers,
+            loop,
+            async_sessionmaker(bind=conn, expire_on_commit=False, join_transaction_mode="create_savepoint"),
+        )
+        try:
+            yield conn
+        finally:
+            await outer.rollback()
+
+
+# One time-skipping test server for the whole session (the test-server subprocess
+# boot is the expensive part). Tests isolate themselves via unique order/workflow ids.
+# Under xdist each worker process starts its own server on an ephemeral port.
+@pytest_asyncio.fixture(scope="session")
+async def workflow_env():
+    env = await WorkflowEnvironment.start_time_skipping()
+    try:
+        yield env
+    finally:
+        await env.shutdown()
+
+
+# The env's gRPC client, shared by every test (closed by the env teardown, not per test)
+@pytest_asyncio.fixture(scope="session")
+async def client(workflow_env) -> Client:
+    return workflow_env.client
+
+
+# Small, explicit sizing instead of SDK defaults (matters with N xdist processes)
+_EXEC = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tt")
+
+# Registration lists built once at import; every test Worker is `Worker(client, **_WORKER_KW, ...)`
+_WORKER_KW = dict(
+    task_queue=ORDERS_TQ,
+    workflows=[OrderWorkflow, ShippingWorkflow],
+    activities=[
+        receive_order,
+        validate_order,
+        charge_payment,
+        persist_address,
+        mark_shipped,
+        process_order_step,
+        prepare_package,
+        dispatch_carrier,
+    ],
+)
+
+
+# One long-lived worker for the whole session: activity registration and poller
+# start-up happen once. Hosts both workflows and every activity they call.
+@pytest_asyncio.fixture(scope="session")
+async def workers(client):
+    async with Worker(
+        client,
+        **_WORKER_KW,
+        activity_executor=_EXEC,
+        max_concurrent_activities=2,
+        max_concurrent_workflow_tasks=2,
+        # >= workflows open at once (the happy batch runs 4 parents + 4 children), so
+        # sticky execution never evicts and replays a run mid-test
+        max_cached_workflows=16,
+        # No sandbox in tests: skips re-importing/validating the workflow modules.
+        # Determinism is still enforced in prod, where workers keep the default runner.
+        workflow_runner=UnsandboxedWorkflowRunner(),
+    ) as worker:
+        yield worker
+    _EXEC.shutdown(wait=False)
@@ -0,0 +1,147 @@
+# tests/test_event_batcher.py
+# EventBatcher with its DB write swapped out, so no MySQL is needed (except the last test)
+import asyncio
+import secrets
+
+import pytest
+from sqlalchemy import text
+
+from app.db import EventBatcher, Session, insert_event_sync
+
+
+class _FakeWrite:
+    """Records each flushed batch; optionally holds a flush open until released."""
+
+    def __init__(self, hold: bool = False) -> None:
+        self.batches = []
+        self.entered = asyncio.Event()
+        self.release = asyncio.Event()
+        if not hold:
+            self.release.set()
+        self.bad = set()  # event types whose rows make the write fail
+
+    async def __call__(self, rows: list) -> None:
+        self.batches.append([r["t"] for r in rows])
+        self.entered.set()
+        await self.release.wait()
+        for r in rows:
+            if r["t"] in self.bad:
+                raise ValueError(f"bad row {r['t']}")
+
+
+def _batcher(write: _FakeWrite) -> EventBatcher:
+    b = EventBatcher()
+    b._write = write
+    return b
+
+
+async def test_lone_event_flushes_immediately():
+    write = _FakeWrite()
+    b = _batcher(write)
+    # Serial path: no timer to wait out, the single event is its own batch
+    await asyncio.wait_for(b.enqueue("o-1", "a"), timeout=0.01)
+    assert write.batches == [["a"]]
+    await b.drain()
+
+
+async def test_events_queued_during_a_flush_coalesce():
+    write = _FakeWrite(hold=True)
+    b = _batcher(write)
+    first = asyncio.create_task(b.enqueue("o-1", "e0"))
+    await write.entered.wait()  # e0 is being flushed on its own
+    rest = [asyncio.create_task(b.enqueue("o-1", f"e{i}")) for i in range(1, 5)]
+    await asyncio.sleep(0)
+    write.release.set()
+    await asyncio.gather(first, *rest)
+    assert write.batches == [["e0"], ["e1", "e2", "e3", "e4"]]
+    await b.drain()
+
+
+async def test_bad_row_fails_only_its_own_caller():
+    write = _FakeWrite(hold=True)
+    write.bad = {"e1"}
+    b = _batcher(write)
+    first = asyncio.create_task(b.enqueue("o-1", "e0"))
+    await write.entered.wait()
+    rest = [asyncio.create_task(b.enqueue("o-1", t)) for t in ("e1", "e2")]
+    await asyncio.sleep(0)
+    write.release.set()
+    results = await asyncio.gather(first, *rest, return_exceptions=True)
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], ValueError)
+    # The failed batch was retried row by row
+    assert write.batches == [["e0"], ["e1", "e2"], ["e1"], ["e2"]]
+    await b.drain()
+
+
+async def test_dispatcher_survives_a_failed_flush():
+    write = _FakeWrite()
+    write.bad = {"e0"}
+    b = _batcher(write)
+    with pytest.raises(ValueError, match="bad row e0"):
+        await b.enqueue("o-1", "e0")
+    await b.enqueue("o-1", "e1")
+    assert write.batches == [["e0"], ["e1"]]
+    await b.drain()
+
+
+async def test_drain_flushes_queued_events_and_stops():
+    write = _FakeWrite(hold=True)
+    b = _batcher(write)
+    first = asyncio.create_task(b.enqueue("o-1", "e0"))
+    await write.entered.wait()
+    queued = asyncio.create_task(b.enqueue("o-1", "e1"))
+    await asyncio.sleep(0)
+    drain = asyncio.create_task(b.drain())
+    await asyncio.sleep(0)
+    write.release.set()
+    await asyncio.gather(first, queued, drain)
+    assert write.batches == [["e0"], ["e1"]]
+    assert b.closed and b._task.done()
+
+
+async def test_dead_dispatcher_fails_waiters_and_restarts():
+    write = _FakeWrite(hold=True)
+    b = _batcher(write)
+    pending = asyncio.create_task(b.enqueue("o-1", "e0"))
+    await write.entered.wait()
+    b._task.cancel()
+    # The in-flight caller gets an error instead of hanging forever
+    with pytest.raises(RuntimeError, match="stopped"):
+        await asyncio.wait_for(pending, timeout=1)
+    # ...and the next enqueue starts a new dispatcher
+    write.release.set()
+    await asyncio.wait_for(b.enqueue("o-1", "e1"), timeout=1)
+    assert write.batches[-1] == ["e1"]
+    await b.drain()
+
+
+async def test_insert_event_sync_runs_without_an_event_loop(monkeypatch):
+    # Blocking fallback: its own throwaway loop, direct (unbatched) write, pool disposed after
+    import app.db as db
+
+    written, disposed = [], []
+
+    async def direct(order_id, type_, payload=None):
+        written.append((order_id, type_, payload))
+
+    async def dispose():
+        disposed.append(True)
+
+    monkeypatch.setattr(db, "_insert_event_direct", direct)
+    monkeypatch.setattr(db, "dispose_engine", dispose)
+    await asyncio.to_thread(db.insert_event_sync, "o-1", "sync_evt", {"k": 1})
+    assert written == [("o-1", "sync_evt", {"k": 1})]
+    assert disposed == [True]
+
+
+@pytest.mark.xdist_group(name="db")
+async def test_insert_event_sync_writes_the_row(db_ready):
+    # Same fallback against MySQL (commits: it runs on its own connection and loop)
+    oid = f"o-{secrets.token_hex(4)}"
+    await asyncio.to_thread(insert_event_sync, oid, "sync_evt", {"k": 1})
+    async with Session().begin() as session:
+        types = (await session.execute(
+            text("SELECT type FROM events WHERE order_id = :oid"), {"oid": oid},
+        )).scalars().all()
+    assert types == ["sync_evt"]
@@ -0,0 +1,13 @@
+# tests/test_logging_setup.py
+import orjson
+
+from app.logging_setup import _orjson_dumps
+
+
+def test_orjson_dumps_accepts_non_str_keys():
+    # stdlib json accepted these; a log call must not raise inside an activity
+    assert orjson.loads(_orjson_dumps({"counts": {1: 2}})) == {"counts": {"1": 2}}
+
+
+def test_orjson_dumps_uses_fallback_for_unknown_types():
+    assert _orjson_dumps({"x": object()}, default=lambda o: "obj") == '{"x":"obj"}'
@@ -0,0 +1,46 @@
+# tests/test_order_step.py
+import secrets
+
+import pytest
+from sqlalchemy import text
+from temporalio.testing import ActivityEnvironment
+
+import app.services as services
+from app.activities import process_order_step
+from app.db import Session
+
+_SQL_STATE = text("SELECT state FROM orders WHERE id = :oid")
+_SQL_EVENTS = text("SELECT type FROM events WHERE order_id = :oid ORDER BY id")
+_SQL_SHIPMENTS = text("SELECT status FROM shipments WHERE order_id = :oid ORDER BY id")
+
+
+async def _rows(oid: str):
+    async with Session().begin() as session:
+        state = await session.scalar(_SQL_STATE, {"oid": oid})
+        events = (await session.execute(_SQL_EVENTS, {"oid": oid})).scalars().all()
+        shipments = (await session.execute(_SQL_SHIPMENTS, {"oid": oid})).scalars().all()
+    return state, events, shipments
+
+
+@pytest.mark.xdist_group(name="db")
+async def test_order_step_writes_state_shipment_and_event(db_rollback):
+    oid = f"o-{secrets.token_hex(4)}"
+
+    s = await services.order_step(oid, "shipping", "carrier_dispatched", {"carrier": "x"}, shipment_status="dispatched")
+
+    assert s == "shipping"
+    assert await _rows(oid) == ("shipping", ["carrier_dispatched"], ["dispatched"])
+
+
+@pytest.mark.xdist_group(name="db")
+async def test_process_order_step_activity(db_rollback):
+    # What OrderWorkflow runs (locally) to mark an order shipped
+    oid = f"o-{secrets.token_hex(4)}"
+
+    s = await ActivityEnvironment().run(
+        process_order_step,
+        {"order_id": oid, "state": "shipped", "event_type": "order_shipped"},
+    )
+
+    assert s == "shipped"
+    assert await _rows(oid) == ("shipped", ["order_shipped"], [])
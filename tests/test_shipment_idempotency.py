@@ -0,0 +1,24 @@
+# tests/test_shipment_idempotency.py
+import secrets
+
+import pytest
+from sqlalchemy import text
+
+import app.services as services
+from app.db import Session
+
+
+@pytest.mark.xdist_group(name="db")
+async def test_package_prepared_idempotent(db_rollback):
+    # A retried step upserts on uq_ship_order_status instead of adding a second row
+    order = {"order_id": f"o-{secrets.token_hex(4)}"}
+
+    assert await services.package_prepared(order) == "Package ready"
+    assert await services.package_prepared(order) == "Package ready"
+
+    async with Session().begin() as session:
+        n = await session.scalar(
+            text("SELECT COUNT(*) FROM shipments WHERE order_id = :oid AND status = 'prepared'"),
+            {"oid": order["order_id"]},
+        )
+    assert n == 1
@@ -1,77 +1,83 @@
 # tests/test_workflow_happy.py
-import uuid
+import asyncio
+import json
 from datetime import timedelta
 
 import pytest
-from temporalio.testing import WorkflowEnvironment
+from sqlalchemy import text
 from temporalio.client import Client
-from temporalio.worker import Worker
 
-from app.workflows import OrderWorkflow, ShippingWorkflow
-from app.activities import (
-    receive_order,
-    validate_order,
-    charge_payment,
-    persist_address,
-    mark_shipped,
-    prepare_package,
-    dispatch_carrier,
-)
-import app.services as services
+from app.config import ORDERS_TQ
+from app.db import Session
+from app.workflows import OrderWorkflow
 
 
-@pytest.mark.asyncio
-async def test_order_workflow_happy(monkeypatch, db_ready):
-    # Make flaky_call deterministic for tests (no random failures / long sleeps)
-    async def _no_flaky():
-        return None
-    monkeypatch.setattr(services, "flaky_call", _no_flaky)
+# Happy-path variants, run as one batch against the shared env/worker (see conftest.py)
+_CASES = [
+    {"address": {"line1": "123 Main", "city": "Chicago"}, "items": [{"sku": "ABC", "qty": 1}]},
+    {"address": {"line1": "9 Elm", "city": "Austin"}, "items": [{"sku": "ABC", "qty": 2}, {"sku": "XYZ", "qty": 1}]},
+    {"address": None, "items": [{"sku": "ABC", "qty": 1}]},  # no address -> persist_address skipped
+    {"address": {"line1": "1 Oak"}, "items": None},  # receive_order fills in default items
+]
 
-    order_id = f"o-{uuid.uuid4().hex[:8]}"
-    payment_id = f"pay-{order_id}"
 
-    # Start Temporal test environment with time-skipping
-    async with await WorkflowEnvironment.start_time_skipping() as env:
-        client: Client = env.client
+@pytest.mark.xdist_group(name="temporal")
+async def test_order_workflow_happy(db_ready, client: Client, workers, new_order_id):
+    # client/workers: session-scoped Temporal test env client + worker (see conftest.py)
+    payloads = []
+    for case in _CASES:
+        order_id = new_order_id()
+        payloads.append({"order_id": order_id, "payment_id": f"pay-{order_id}", **case})
 
-        # Run both workers in-process on their task queues
-        async with (
-            Worker(
-                client,
-                task_queue="orders-tq",
-                workflows=[OrderWorkflow],
-                activities=[receive_order, validate_order, charge_payment, persist_address, mark_shipped],
-            ),
-            Worker(
-                client,
-                task_queue="shipping-tq",
-                workflows=[ShippingWorkflow],
-                activities=[prepare_package, dispatch_carrier],
-            ),
-        ):
-            # Start workflow (single payload dict)
-            handle = await client.start_workflow(
-                OrderWorkflow.run,
-                {
-                    "order_id": order_id,
-                    "payment_id": payment_id,
-                    "address": {"line1": "123 Main", "city": "Chicago"},
-                    "items": [{"sku": "ABC", "qty": 1}],
-                },
-                id=f"order-{order_id}",
-                task_queue="orders-tq",
-                run_timeout=timedelta(seconds=15),
-            )
+    # Start all workflows concurrently, each with approve (manual review gate) in the
+    # same round-trip via signal-with-start
+    handles = await asyncio.gather(*(
+        client.start_workflow(
+            OrderWorkflow.run,
+            p,  # single payload dict
+            id=f"order-{p['order_id']}",
+            task_queue=ORDERS_TQ,
+            # Time-skipping compresses timers, so a healthy run needs far less than this;
+            # tight bounds make a hang fail fast instead of burning CI time
+            run_timeout=timedelta(seconds=3),
+            task_timeout=timedelta(seconds=1),
+            start_signal="approve",
+        )
+        for p in payloads
+    ))
 
-            # Approve immediately (manual review gate)
-            await handle.signal(OrderWorkflow.approve)
+    # Await completion; the runs overlap on the worker. run() returns its final state,
+    # so there's no follow-up status query per workflow
+    results = await asyncio.gather(*(h.result() for h in handles))
+    for res in results:
+        assert res["result"] == "shipped"
+        assert res["approved"] is True
+        assert res["step"] == "done"
+        assert res["last_error"] is None
 
-            # Await completion
-            result = await handle.result()
-            assert result == "shipped"
 
-            # Query status
-            status = await handle.query(OrderWorkflow.status)
-            assert status["step"] == "done"
-            assert status["approved"] is True
-            assert status["last_error"] is None
+@pytest.mark.xdist_group(name="temporal")
+async def test_order_workflow_signal_before_run(db_ready, client: Client, workers, new_order_id):
+    # update_address as the start signal is handled before run() starts: it must
+    # survive state init and win over the payload's address
+    order_id = new_order_id()
+    new_address = {"line1": "77 Signal St", "city": "Denver"}
+    handle = await client.start_workflow(
+        OrderWorkflow.run,
+        {"order_id": order_id, "payment_id": f"pay-{order_id}", "address": {"line1": "old"}, "items": None},
+        id=f"order-{order_id}",
+        task_queue=ORDERS_TQ,
+        run_timeout=timedelta(seconds=3),
+        task_timeout=timedelta(seconds=1),
+        start_signal="update_address",
+        start_signal_args=[new_address],
+    )
+    await handle.signal(OrderWorkflow.approve)
+
+    res = await handle.result()
+    assert res["result"] == "shipped"
+    assert res["approved"] is True
+
+    async with Session().begin() as session:
+        stored = await session.scalar(text("SELECT address_json FROM orders WHERE id = :oid"), {"oid": order_id})
+    assert json.loads(stored) == new_address
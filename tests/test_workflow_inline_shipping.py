@@ -0,0 +1,75 @@
+# tests/test_workflow_inline_shipping.py
+from datetime import timedelta
+
+import pytest
+from temporalio.client import Client
+from temporalio.service import RPCError, RPCStatusCode
+
+import app.services as services
+import app.workflows as workflows
+from app.config import ORDERS_TQ
+from app.workflows import OrderWorkflow
+
+
+async def _start(client: Client, order_id: str):
+    return await client.start_workflow(
+        OrderWorkflow.run,
+        {"order_id": order_id, "payment_id": f"pay-{order_id}", "address": {"line1": "1 Inline"}, "items": None},
+        id=f"order-{order_id}",
+        task_queue=ORDERS_TQ,
+        run_timeout=timedelta(seconds=3),
+        task_timeout=timedelta(seconds=1),
+        start_signal="approve",
+    )
+
+
+async def _assert_no_child(client: Client, order_id: str) -> None:
+    with pytest.raises(RPCError) as e:
+        await client.get_workflow_handle(f"ship-{order_id}-1").describe()
+    assert e.value.status == RPCStatusCode.NOT_FOUND
+
+
+@pytest.mark.xdist_group(name="temporal")
+async def test_inline_shipping_happy(db_ready, client: Client, workers, monkeypatch, new_order_id):
+    # The test worker is unsandboxed, so the module flag can be flipped in-process
+    monkeypatch.setattr(workflows, "INLINE_SHIPPING", True)
+    order_id = new_order_id()
+
+    res = await (await _start(client, order_id)).result()
+
+    assert res["result"] == "shipped"
+    assert res["step"] == "done"
+    await _assert_no_child(client, order_id)
+
+
+@pytest.mark.xdist_group(name="temporal")
+async def test_inline_shipping_retry_only_redispatches(db_ready, client: Client, workers, monkeypatch, new_order_id):
+    monkeypatch.setattr(workflows, "INLINE_SHIPPING", True)
+    order_id = new_order_id()
+
+    calls = {"prepare": 0, "dispatch": 0}
+    real_prepare, real_dispatch = services.package_prepared, services.carrier_dispatched
+
+    async def prepare(order):
+        calls["prepare"] += 1
+        return await real_prepare(order)
+
+    async def dispatch(order):
+        calls["dispatch"] += 1
+        if calls["dispatch"] <= 2:  # both attempts of the first dispatch_carrier activity
+            raise RuntimeError("carrier down")
+        return await real_dispatch(order)
+
+    monkeypatch.setattr(services, "package_prepared", prepare)
+    monkeypatch.setattr(services, "carrier_dispatched", dispatch)
+
+    handle = await _start(client, order_id)
+    res = await handle.result()
+
+    assert res["result"] == "shipped"
+    assert res["last_error"].startswith("shipping_failed")
+    assert calls == {"prepare": 1, "dispatch": 3}
+    status = await handle.query(OrderWorkflow.status)
+    assert status["child_attempts"] == 2
+    assert status["dispatch_failed_reason"]  # set inline, where the child would have signalled it
+    await _assert_no_child(client, order_id)